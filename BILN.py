@@ -16,12 +16,29 @@ __version__ = "1.0"
 # Modules
 ########################################################################################
 
-import copy
 import re
 import logging
 import argparse
 import sys
+import multiprocessing as mp
+import itertools
+from collections import defaultdict
 
+# Logger of the script, set up in the main function
+logger = None
+
+# Tables with fewer rows are converted without starting a pool of workers
+POOL_MIN_ROWS = 1000
+
+# Handler collecting the log records of a worker process, set up by initWorker
+_workerRecords = None
+
+# Precompiled regular expressions
+# a $ sign followed by , or ; belongs to a cxsmiles unless no other separator follows it
+_RE_HELM_SPLIT = re.compile(r'\$(?=[^,;])|\$(?!.*\$[^,;])', re.DOTALL)
+_RE_RESIDUE = re.compile(r'([^(]+)((?:\(\d+,\d+\))*)')
+_RE_BOND = re.compile(r'\((\d+),(\d+)\)')
+_RE_PARENS = re.compile(r'\(.*\)')
 ##########################################################################
 # Main class
 ##########################################################################
@@ -59,10 +76,8 @@ class BILN:
             :param newseq: new list without the brackets
             :type newseq: list
         """
-        newseq = []
-        for r in sequence:
-            p = re.sub(r'\[(.*)\]', r'\1', r)  # remove brackets if necessary
-            newseq.append(p)
+        # remove brackets if necessary
+        newseq = [r[1:-1] if r.startswith('[') and r.endswith(']') else r for r in sequence]
 
         return newseq
 
@@ -80,20 +95,9 @@ class BILN:
             :type helm_parts: list
         """
 
-        helm_parts = []
-        while len(helm):
-            m = re.search('\$[^,;]', helm)  # this excludes any $ signs in the cxsmiles
-            if m is None:
-                m = re.search('\$', helm)  # search for all other $ signs
-
-            if m is None:
-                helm_parts.append(helm)  # done, no more parts
-                break
-
-            else:
-                helm_parts.append(helm[:m.span()[0]])
-
-                helm = helm[m.span()[0] + 1:]  # remove the current part from helm
+        helm_parts = _RE_HELM_SPLIT.split(helm)
+        if helm.endswith('$'):
+            helm_parts.pop()  # a trailing $ sign does not open a new part
 
         if len(helm_parts) == 4:
             helm_parts.append('')
@@ -129,14 +133,14 @@ class BILN:
             :type biln: string
         """
 
-        chains = copy.deepcopy(self.polymerinfo["chains"])
-        bonds = copy.deepcopy(self.polymerinfo["bonds"])
+        # shallow copy of the chains, the residues get annotated below
+        chains = [list(c) for c in self.polymerinfo["chains"]]
 
         # move bond info into monomers
-        for ibond, bond in enumerate(bonds):
+        for ibond, bond in enumerate(self.polymerinfo["bonds"]):
             c1, res1, Rgroup1, c2, res2, Rgroup2 = bond
-            chains[c1][res1] = "{}({},{})".format(chains[c1][res1], ibond + 1, Rgroup1)
-            chains[c2][res2] = "{}({},{})".format(chains[c2][res2], ibond + 1, Rgroup2)
+            chains[c1][res1] = f"{chains[c1][res1]}({ibond + 1},{Rgroup1})"
+            chains[c2][res2] = f"{chains[c2][res2]}({ibond + 1},{Rgroup2})"
 
         # chain everything together
         listOfsimplePolymers = []
@@ -160,27 +164,18 @@ class BILN:
             :type helm: string
         """
 
-        chains = copy.deepcopy(self.polymerinfo["chains"])
-        bonds = copy.deepcopy(self.polymerinfo["bonds"])
-
-        # brackets around residues if necessary
-        for ic, c in enumerate(chains):
-            for ir, res in enumerate(c):
-                if len(res) > 1:
-                    chains[ic][ir] = "[{}]".format(res)
-
         # generate HELM elements
-        # compile chains
+        # compile chains, with brackets around residues if necessary
         listOfSimplePolymers = []
-        for ic, c in enumerate(chains):
-            poly = ".".join(c)
-            listOfSimplePolymers.append('PEPTIDE{}{{{}}}'.format(ic + 1, poly))
+        for ic, c in enumerate(self.polymerinfo["chains"]):
+            poly = ".".join(f"[{res}]" if len(res) > 1 else res for res in c)
+            listOfSimplePolymers.append(f'PEPTIDE{ic + 1}{{{poly}}}')
 
         # compile bondinfo
         listOfConnections = []
-        for bond in bonds:
+        for bond in self.polymerinfo["bonds"]:
             c1, r1, g1, c2, r2, g2 = bond
-            bondInfo = 'PEPTIDE{},PEPTIDE{},{}:R{}-{}:R{}'.format(c1 + 1, c2 + 1, r1 + 1, g1, r2 + 1, g2)
+            bondInfo = f'PEPTIDE{c1 + 1},PEPTIDE{c2 + 1},{r1 + 1}:R{g1}-{r2 + 1}:R{g2}'
             listOfConnections.append(bondInfo)
 
         listOfConnections = '|'.join(listOfConnections)
@@ -189,7 +184,7 @@ class BILN:
         if not listOfSimplePolymers:
             helm = None
         else:
-            helm = "{}${}$$$V2.0".format(listOfSimplePolymers, listOfConnections)
+            helm = f"{listOfSimplePolymers}${listOfConnections}$$$V2.0"
 
         return helm
 
@@ -225,38 +220,37 @@ class BILN:
         # go through the list of simple polymers (first component of HELM string), parse them and put them into
         # polymerinfo["chains"]
 
-        pattern = re.compile(r'{.*}')
-
-        id = []
-        polymer = []
+        n = len(listOfSimplePolymers)
+        chainIds = [0] * n
+        polymer = [None] * n
 
         for idx, chain in enumerate(listOfSimplePolymers):
 
             # remove any whitespace
             chain = chain.strip()
             # split each polymer into name/identifier and sequence
-            m = pattern.search(chain)
-            if m is None:
+            lb = chain.find('{')
+            rb = chain.rfind('}')
+            if lb < 0 or rb < lb:
                 logger and logger.error('no sequence information found in simple polymer - check HELM')
                 logger and logger.error('input: {}'.format(chain))
                 return None
 
             # split each polymer into name/identifier and sequence
-            s = m.span()
-            ic = chain[:s[0]]  # identifier
-            if ic[0:4] == 'CHEM':
+            ic = chain[:lb]  # identifier
+            if ic.startswith('CHEM'):
                 logger and logger.error(
                     'polymer contains an explicit chemical entity - missing or not recognized monomer:')
                 logger and logger.error(chain)
                 return None
-            elif ic[0:7] != 'PEPTIDE':
+            elif not ic.startswith('PEPTIDE'):
                 logger and logger.error('non-peptide chains in HELM - probably missing monomer')
                 logger and logger.error('found: {}'.format(ic))
                 return None
             else:
-                ic = int(re.sub('PEPTIDE', '', ic))
+                ic = int(ic[7:])
 
-            p = chain[s[0] + 1:s[1] - 1]  # sequence
+            p = chain[lb + 1:rb]  # sequence
 
             if not len(p):
                 logger and logger.error('simple polymer {} is declared but not defined - has no length'.format(p))
@@ -266,11 +260,16 @@ class BILN:
 
             p = self.__removeBrackets(p)  # remove brackets around monomer abbreviations with more than 1 letter
 
-            id.append(ic)
-            polymer.append(p)
+            chainIds[idx] = ic
+            polymer[idx] = [sys.intern(r) for r in p]
 
         self.polymerinfo["chains"] = polymer
 
+        # position of each chain identifier in polymerinfo["chains"] (first occurrence as with list.index)
+        chainPosition = {}
+        for pos, ic in enumerate(chainIds):
+            chainPosition.setdefault(ic, pos)
+
         # parse the bond information
 
         # bond information is of the type: 'PEPTIDE1,PEPTIDE2,1:R1-4:R3'
@@ -280,25 +279,30 @@ class BILN:
             for idx, conn in enumerate(listOfConnections):
                 id1, id2, bond = conn.split(',')
 
-                res1, rgroup1, res2, rgroup2 = re.split('[-:]', bond)
+                res1, rgroup1, res2, rgroup2 = bond.replace('-', ':').split(':')
 
                 # need some reformatting
-                id1 = int(id1.replace('PEPTIDE', ''))
-                id2 = int(id2.replace('PEPTIDE', ''))
+                id1 = int(id1[7:])
+                id2 = int(id2[7:])
 
                 # translate back to current order of chains in polymerinfo["chains"]
-                id1 = id.index(id1)
-                id2 = id.index(id2)
+                try:
+                    id1 = chainPosition[id1]
+                    id2 = chainPosition[id2]
+                except KeyError as e:
+                    # same error as list.index for a chain that is not declared
+                    raise ValueError('{} is not in list'.format(e.args[0])) from None
 
                 # start counting of residues at 0
                 res1 = int(res1) - 1
                 res2 = int(res2) - 1
 
                 # get the number of the Rgroup (keep numbering 1-3)
-                rgroup1 = int(rgroup1.replace('R', ''))
-                rgroup2 = int(rgroup2.replace('R', ''))
+                rgroup1 = int(rgroup1[1:])
+                rgroup2 = int(rgroup2[1:])
 
-                logger and logger.debug('bond :{}'.format(', '.join([str(id1), str(res1), str(rgroup1), str(id2), str(res2), str(rgroup2)])))
+                if logger is not None:
+                    logger.debug('bond :%s, %s, %s, %s, %s, %s', id1, res1, rgroup1, id2, res2, rgroup2)
 
                 bonds.append([id1, res1, rgroup1, id2, res2, rgroup2])
 
@@ -319,34 +323,47 @@ class BILN:
             :type biln: string
         """
 
+        # bonds only exist if there are bond markers, otherwise just split chains and residues
+        if '(' not in biln:
+            self.polymerinfo["chains"] = [[sys.intern(r) for r in c.split("-")] for c in biln.split(".")]
+            self.polymerinfo["bonds"] = []
+            return
+
         # split BILN into chains
         chains = biln.split(".")
 
-        bondinfo = {}
+        bondinfo = defaultdict(list)
         listOfSimplePolymers = []
 
+        # local references to the methods used in the loops
+        matchResidue = _RE_RESIDUE.fullmatch
+        findBonds = _RE_BOND.findall
+        removeParens = _RE_PARENS.sub
+        addPolymer = listOfSimplePolymers.append
+
         for cidx, c in enumerate(chains):
             residues = c.split("-")
 
             # go through residues and collect the bond information needed
             polymer = []
+            addResidue = polymer.append
             for ridx, r in enumerate(residues):
-                match = re.findall(r"\((\d+),(\d+)\)", r)
-                resname = re.sub(r"\(.*\)", "", r)
+                # residue name followed by its bond markers, e.g. K(1,3)(2,2)
+                m = matchResidue(r)
+                if m is not None:
+                    resname = m.group(1)
+                    match = findBonds(m.group(2))
+                else:
+                    match = findBonds(r)
+                    resname = removeParens("", r)
                 if match:
                     for m in match:
                         bidx = m[0]
                         gidx = int(m[1])
-                        try:
-                            bondinfo[bidx].append(cidx)
-                        except:
-                            bondinfo[bidx] = [cidx]
-
-                        bondinfo[bidx].append(ridx)
-                        bondinfo[bidx].append(gidx)
+                        bondinfo[bidx].extend((cidx, ridx, gidx))
 
-                polymer.append(resname)
-            listOfSimplePolymers.append(polymer)
+                addResidue(sys.intern(resname))
+            addPolymer(polymer)
 
         self.polymerinfo["chains"] = listOfSimplePolymers
 
@@ -382,12 +399,11 @@ class BILN:
 ##########################################################################
 # Additional function
 ##########################################################################
-def splitOutside(string, by, outside, keepMarker=True):
+def _splitOutsidePy(string, by, outside, keepMarker=True):
     """splits a string by delimiter only if outside of a given delimiter (bracket, quote, ...)
     The function keeps track of opening and closing parens, brackets and braces, as well as single and double quotes,
-    and performs a replacement only outside of such bracketed and quoted substrings.
-    Then replaces the non-bracketed/quoted search characters with another character which definitely doesn't appear
-    in the string (e.g. ASCII/Unicode group-separator: chr(29) code), then do a simple string.split on that character.
+    and splits only outside of such bracketed and quoted substrings. The chunks are collected in a single pass
+    over the string.
 
     Args:
         :param string: string to be split
@@ -404,40 +420,155 @@ def splitOutside(string, by, outside, keepMarker=True):
         :type splitChains: list
     """
     # by can be more than 1 character
-    by = list(by)
+    by = set(by)
 
     # if outside is only one character (e.g. ', "), double it for start and end
     if len(outside) == 1:
         outside = outside + outside
+    start, end = outside[0], outside[1]
 
-    # Special character
-    GRPSEP = chr(29)
-
-    out = ''
+    splitChains = []
+    chunk = []
+    addChain = splitChains.append
+    addChar = chunk.append
     inside = False
     for i in string:
-        if i == outside[0]:
-            if inside:
-                if keepMarker: j = i
-                else: j = ''
-                inside = False
-            else:
-                inside = True
-                if keepMarker: j = i
-                else: j = ''
-        elif i == outside[1]:
-            inside = False
-            if keepMarker: j = i
-            else: j = ''
+        if i == start or i == end:
+            # opening marker toggles, closing marker always ends the bracketed part
+            inside = not inside if i == start else False
+            if keepMarker: addChar(i)
+        elif not inside and i in by:
+            addChain(''.join(chunk))
+            chunk.clear()
         else:
-            if not inside and i in by: j = GRPSEP
-            else: j = i
-        out = out + j
+            addChar(i)
 
-    # Do the final split
-    splitChains = out.split(GRPSEP)
+    # Add the last chunk
+    addChain(''.join(chunk))
     return splitChains
 
+# Use the compiled splitOutside if the Cython extension was built (cythonize -i _splitoutside.pyx)
+try:
+    from _splitoutside import splitOutside
+except ImportError:
+    splitOutside = _splitOutsidePy
+
+##########################################################################
+class RecordCollector(logging.Handler):
+    """logging handler keeping the records of a worker process to be logged later by the main process"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # format the message here, the arguments do not need to be sent to the main process
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+##########################################################################
+def initWorker(level):
+    """set up the logger of a worker process, its records are sent back with each converted line
+
+    Args:
+        :param level: logging level of the main process
+        :type level: int
+    """
+    global logger, _workerRecords
+
+    _workerRecords = RecordCollector()
+    logger = logging.Logger(name="Worker")
+    logger.setLevel(level)
+    logger.addHandler(_workerRecords)
+
+##########################################################################
+def popRecords():
+    """return and clear the log records collected in a worker process, empty outside of workers"""
+    if _workerRecords is None:
+        return []
+
+    records = _workerRecords.records
+    _workerRecords.records = []
+    return records
+
+##########################################################################
+def bilnToHELM(line):
+    """convert one line of a BILN table into HELM
+
+    Args:
+        :param line: line of the table containing a BILN string
+        :type line: str
+
+    Returns:
+        :param result: the input line, the HELM line for the report, the error message if the conversion failed
+        and the log records of the conversion
+        :type result: tuple
+    """
+    try:
+        helm = BILN(biln=line.strip()).getHELM()
+        return line, helm + '\n', None, popRecords()
+    except Exception as e:
+        return line, None, str(e), popRecords()
+
+##########################################################################
+def helmToBILN(line):
+    """convert one line of a HELM table into BILN
+
+    Args:
+        :param line: line of the table containing a HELM string
+        :type line: str
+
+    Returns:
+        :param result: the input line, the BILN line for the report, the error message if the conversion failed
+        and the log records of the conversion
+        :type result: tuple
+    """
+    try:
+        biln = BILN(helm=line.strip()).getBILN()
+        return line, biln + '\n', None, popRecords()
+    except Exception as e:
+        return line, None, str(e), popRecords()
+
+##########################################################################
+def convertTable(lines, convert, processes=None):
+    """convert the lines of a table, in a pool of workers if the table is large enough
+
+    Args:
+        :param lines: lines of the table, read as they are needed
+        :type lines: iterator
+        :param convert: function converting one line (bilnToHELM or helmToBILN)
+        :type convert: function
+        :param processes: number of worker processes, all cores if None and no pool if 1
+        :type processes: int
+
+    Returns:
+        :param results: iterator over the results of convert, in the order of the table
+        :type results: iterator
+    """
+    # only the first lines are read to decide if the table is large enough for a pool
+    lines = iter(lines)
+    head = list(itertools.islice(lines, POOL_MIN_ROWS))
+    lines = itertools.chain(head, lines)
+
+    if processes == 1 or (processes is None and len(head) < POOL_MIN_ROWS):
+        yield from map(convert, lines)
+    else:
+        level = logger.level if logger is not None else logging.WARNING
+        with mp.Pool(processes, initializer=initWorker, initargs=(level,)) as pool:
+            # lines are independent, imap keeps the order of the table
+            yield from pool.imap(convert, lines, chunksize=256)
+
+##########################################################################
+def positiveInt(value):
+    """argparse type for options that need a number of at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got {}".format(value))
+
+    return number
+
 ##########################################################################
 def getInputsParser():
     """Constructs parser for inputs."""
@@ -462,6 +593,11 @@ def getInputsParser():
         required=False,
         help="Table containing HELM strings to convert into BILN.")
 
+    parser.add_argument(
+        '--processes', type=positiveInt, metavar='number',
+        required=False, default=None,
+        help="Number of processes used to convert tables, default is all cores for tables with at least {} lines.".format(POOL_MIN_ROWS))
+
     # A repeated-use log option parser.
     logOptions = parser.add_argument_group('Logging options')
     logOptions.add_argument(
@@ -516,30 +652,30 @@ if __name__ == "__main__":
 
     # 3. A file with a list of BILN molecules
     elif args.table_biln:
-        report = open('report_biln.txt','w')
-        with open(args.table_biln) as inTable:
-            for line in inTable:
-                try:
-                    b = BILN(biln=line.strip())
-                    helm = b.getHELM()
-                    report.write(helm+'\n')
+        with open(args.table_biln) as inTable, open('report_biln.txt','w', buffering=65536) as report:
+            for line, helm, error, records in convertTable(inTable, bilnToHELM, args.processes):
+                # messages of the conversions done in the workers
+                for record in records:
+                    logger.handle(record)
+                if error is None:
+                    report.write(helm)
                     logger.info("Reading biln molecule: {}".format(line))
-                except Exception as e:
-                    logger.warning("Failed to process {},{}".format(line,e))
+                else:
+                    logger.warning("Failed to process {},{}".format(line,error))
         print("The HELM formats were generated and saved in report_biln.txt")
 
     # 4. A file with a list of HELM molecules
     elif args.table_helm:
-        report = open('report_helm.txt','w')
-        with open(args.table_helm) as inTable:
-            for line in inTable:
-                try:
-                    b = BILN(helm=line.strip())
-                    biln = b.getBILN()
-                    report.write(biln+'\n')
+        with open(args.table_helm) as inTable, open('report_helm.txt','w', buffering=65536) as report:
+            for line, biln, error, records in convertTable(inTable, helmToBILN, args.processes):
+                # messages of the conversions done in the workers
+                for record in records:
+                    logger.handle(record)
+                if error is None:
+                    report.write(biln)
                     logger.info("Reading helm molecule: {}".format(line))
-                except Exception as e:
-                    logger.warning("Failed to process {},{}".format(line,e))
+                else:
+                    logger.warning("Failed to process {},{}".format(line,error))
         print("The BILN formats were generated and saved in report_helm.txt")
 
     # Termination and cleanup.
@@ -0,0 +1,112 @@
+# cython: language_level=3
+"""Compiled version of splitOutside from BILN.py
+
+Build it in place with: cythonize -i _splitoutside.pyx
+BILN.py uses it automatically when the extension can be imported.
+"""
+
+########################################################################################
+# Authorship
+########################################################################################
+
+__credits__ = ["Thomas Fox", "Michael Bieler", "Peter Haebel", "Rodrigo Ochoa", "Stefan Peters", "Alexander Weber"]
+__license__ = "MIT"
+__version__ = "1.0"
+
+########################################################################################
+# Modules
+########################################################################################
+
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
+
+##########################################################################
+def splitOutside(str string, by, str outside, bint keepMarker=True):
+    """splits a string by delimiter only if outside of a given delimiter (bracket, quote, ...)
+    Same behaviour as the pure python splitOutside in BILN.py, the chunks are taken as slices of the input string.
+
+    Args:
+        :param string: string to be split
+        :type string: str
+        :param by: delimiter(s) by which to be split
+        :type by: str or list
+        :param outside: only split if outside of this
+        :type outside: str
+        :param keepMarker: if True keep the chunk marker, remove otherwise
+        :type keepMarker: bool
+
+    Returns:
+        :param splitChains: split string as list
+        :type splitChains: list
+    """
+    cdef Py_ssize_t k, nby
+    cdef Py_UCS4 *delimiters
+
+    # by can be more than 1 character, any container of characters is accepted
+    by = ''.join(set(by))
+    nby = len(by)
+
+    # if outside is only one character (e.g. ', "), double it for start and end
+    if len(outside) == 1:
+        outside = outside + outside
+
+    # delimiters as C characters, so the membership test does not create python objects
+    delimiters = <Py_UCS4 *> PyMem_Malloc(max(nby, 1) * sizeof(Py_UCS4))
+    if delimiters == NULL:
+        raise MemoryError()
+    try:
+        for k in range(nby):
+            delimiters[k] = by[k]
+        return splitChars(string, delimiters, nby, outside[0], outside[1], keepMarker)
+    finally:
+        PyMem_Free(delimiters)
+
+##########################################################################
+cdef list splitChars(str string, Py_UCS4 *delimiters, Py_ssize_t nby, Py_UCS4 start, Py_UCS4 end, bint keepMarker):
+    """state machine of splitOutside working on C characters"""
+    cdef Py_UCS4 i
+    cdef Py_ssize_t k, pos = 0, first = 0
+    cdef bint inside = False, isDelimiter
+    cdef list splitChains = []
+    cdef list chunk = []
+
+    for i in string:
+        if i == start or i == end:
+            # opening marker toggles, closing marker always ends the bracketed part
+            inside = not inside if i == start else False
+            if not keepMarker:
+                if pos > first:
+                    chunk.append(string[first:pos])
+                first = pos + 1
+        elif not inside:
+            isDelimiter = False
+            for k in range(nby):
+                if i == delimiters[k]:
+                    isDelimiter = True
+                    break
+            if isDelimiter:
+                if keepMarker:
+                    # the chunk is a single slice of the input string
+                    splitChains.append(string[first:pos])
+                else:
+                    splitChains.append(joinChunk(chunk, string[first:pos]))
+                    chunk = []
+                first = pos + 1
+        pos += 1
+
+    # Add the last chunk
+    if keepMarker:
+        splitChains.append(string[first:])
+    else:
+        splitChains.append(joinChunk(chunk, string[first:]))
+    return splitChains
+
+##########################################################################
+cdef str joinChunk(list chunk, str last):
+    """join the pieces of a chunk whose markers were removed, without joining if there is a single piece"""
+    if not chunk:
+        return last
+    if last:
+        chunk.append(last)
+    if len(chunk) == 1:
+        return chunk[0]
+    return ''.join(chunk)